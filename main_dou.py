@@ -1,11 +1,16 @@
 # main_dou.py (env-ready)
 import asyncio
+import hashlib
 import html
 import logging
 import os
+import re
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
-from urllib.parse import urlencode
+from io import BytesIO
+from typing import Dict, List, Mapping, Optional, Tuple
+from urllib.parse import quote_plus
 
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.client.default import DefaultBotProperties
@@ -13,11 +18,14 @@ from aiogram.enums import ParseMode
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import CallbackQuery, Message
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, Message
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 import aiohttp
-import feedparser
+from lxml import etree
+from selectolax.lexbor import LexborHTMLParser
 
 # Load environment variables
 try:
@@ -34,6 +42,7 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "PLACEHOLDER_TOKEN")
 OWNER_NAME = os.getenv("OWNER_NAME", "Author Name")
 OWNER_URL = os.getenv("OWNER_URL", "https://example.com")
 ALLOW_RU = os.getenv("ALLOW_RU", "true").strip().lower() in ("1", "true", "yes", "y")
+REDIS_URL = os.getenv("REDIS_URL", "").strip()
 
 if not BOT_TOKEN or BOT_TOKEN == "PLACEHOLDER_TOKEN":
     raise RuntimeError("BOT_TOKEN is not set. Create a .env with BOT_TOKEN=... or set it in your environment.")
@@ -97,11 +106,18 @@ def kb_review():
     kb.adjust(2)
     return kb.as_markup()
 
-def val2label(value: str, options: List[Tuple[str, str]]) -> str:
-    for t, v in options:
-        if v == value:
-            return t
-    return value
+# Клавиатуры статичны — собираем их один раз при импорте
+KB_COUNTRY = kb_options(COUNTRIES, "country", add_back=False)
+KB_SPHERE  = kb_options(SPHERES, "sphere", add_back=True)
+KB_FORMAT  = kb_options(FORMATS, "format", add_back=True)
+KB_REVIEW  = kb_review()
+
+COUNTRIES_BY_VAL: Dict[str, str] = {v: t for t, v in COUNTRIES}
+SPHERES_BY_VAL: Dict[str, str] = {v: t for t, v in SPHERES}
+FORMATS_BY_VAL: Dict[str, str] = {v: t for t, v in FORMATS}
+
+def val2label(value: str, table: Dict[str, str]) -> str:
+    return table.get(value, value)
 
 @dataclass
 class Prefs:
@@ -109,26 +125,41 @@ class Prefs:
     sphere: Optional[str] = None
     format_: Optional[str] = None
 
+def prefs_from_data(data: Dict) -> Prefs:
+    # в FSM храним плоские ключи country/sphere/format_, без вложенного dict
+    return Prefs(country=data.get("country"), sphere=data.get("sphere"), format_=data.get("format_"))
+
 def prefs_to_text(p: Prefs) -> str:
-    country = val2label(p.country, COUNTRIES) if p.country else "—"
-    sphere  = val2label(p.sphere,  SPHERES)  if p.sphere  else "—"
-    fmt     = val2label(p.format_, FORMATS) if p.format_ else "—"
+    country = val2label(p.country, COUNTRIES_BY_VAL) if p.country else "—"
+    sphere  = val2label(p.sphere,  SPHERES_BY_VAL)  if p.sphere  else "—"
+    fmt     = val2label(p.format_, FORMATS_BY_VAL) if p.format_ else "—"
     return f"🌍 Страна: {country}\n🧭 Сфера: {sphere}\n🧩 Формат: {fmt}"
 
 def normalize_html(s: str) -> str:
     return html.escape(s, quote=True)
 
+# (title, link) — сырые данные вакансии; в HTML превращаем один раз при рендере
+JobItem = Tuple[str, str]
+
+def render_jobs(items: List[JobItem]) -> str:
+    return "\n".join(f'• <a href="{normalize_html(link)}">{normalize_html(title)}</a>' for title, link in items)
+
 # ---------- Optional RU filter ----------
 FORBIDDEN_TERMS = (
     " russia ", " россия ", " росія ", " рф ",
     " moscow ", " москва ",
     " saint petersburg ", " st. petersburg ", " санкт-петербург ", " санкт петербург ",
 )
-def contains_forbidden(text: str) -> bool:
-    if ALLOW_RU:
+# один проход по строке вместо N проверок `term in t`
+FORBIDDEN_RE = re.compile("|".join(re.escape(t) for t in FORBIDDEN_TERMS), re.IGNORECASE)
+
+# ветку ALLOW_RU решаем один раз при импорте, а не на каждой проверке
+if ALLOW_RU:
+    def contains_forbidden(text: str) -> bool:
         return False
-    t = f" { (text or '').lower() } "
-    return any(term in t for term in FORBIDDEN_TERMS)
+else:
+    def contains_forbidden(text: str) -> bool:
+        return bool(FORBIDDEN_RE.search(f" {text or ''} "))
 
 # ---------- DOU maps ----------
 UA_CATEGORY_MAP: Dict[str, Optional[str]] = {
@@ -151,31 +182,116 @@ EU_CATEGORY_MAP: Dict[str, Optional[str]] = {
     "BACKEND": None,
     "ANY": None,
 }
+# маркеры формата в тексте карточки DOU.eu (сравниваем в нижнем регистре)
+PT_TOKENS = ("part-time", "part time")
+CONTRACT_TOKENS = ("contract",)
 
 # ---------- HTTP ----------
+HTTP_HEADERS = {"User-Agent": "Mozilla/5.0 (compatible; JobBot/1.0)"}
+
+def make_http_session() -> aiohttp.ClientSession:
+    # одна сессия на всё время жизни бота: keep-alive и пул соединений к DOU
+    return aiohttp.ClientSession(
+        headers=HTTP_HEADERS,
+        # общий дедлайн поиска задаёт SEARCH_DEADLINE, здесь — потолок на один запрос
+        timeout=aiohttp.ClientTimeout(total=8),
+        connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=75),
+    )
+
 async def fetch_text(session: aiohttp.ClientSession, url: str) -> str:
-    async with session.get(url, timeout=aiohttp.ClientTimeout(total=25)) as resp:
+    async with session.get(url) as resp:
         resp.raise_for_status()
         return await resp.text()
 
-async def fetch_feed(session: aiohttp.ClientSession, url: str):
-    txt = await fetch_text(session, url)
-    return feedparser.parse(txt)
+async def fetch_bytes(session: aiohttp.ClientSession, url: str, headers: Optional[Dict[str, str]] = None) -> Tuple[int, Mapping[str, str], bytes]:
+    # сырые байты без декодирования: XML-парсер сам определит кодировку из пролога
+    async with session.get(url, headers=headers) as resp:
+        if resp.status == 304:
+            return resp.status, resp.headers, b""
+        resp.raise_for_status()
+        return resp.status, resp.headers, await resp.read()
+
+def parse_rss_titles_links(xml_bytes: bytes, limit: int) -> List[JobItem]:
+    # потоковый разбор RSS: берём только title/link, фильтруем сразу и останавливаемся на limit
+    out: List[JobItem] = []
+    if limit <= 0:
+        return out
+    items = etree.iterparse(
+        BytesIO(xml_bytes), events=("end",), tag="item",
+        resolve_entities=False, no_network=True,
+    )
+    for _, item in items:
+        title = (item.findtext("title") or "").strip()
+        link  = (item.findtext("link") or "").strip()
+        item.clear()
+        if not title or not link:
+            continue
+        if contains_forbidden(title) or contains_forbidden(link):
+            continue
+        out.append((title, link))
+        if len(out) >= limit:
+            break
+    return out
+
+# ---------- Feed cache ----------
+FEED_CACHE_TTL = 300
+FEED_CACHE_MAX = 256
+
+@dataclass
+class CacheEntry:
+    etag: Optional[str]
+    last_modified: Optional[str]
+    items: List[JobItem]
+    expires_at: float
+
+# LRU: (url, limit) -> CacheEntry
+FEED_CACHE: "OrderedDict[Tuple[str, int], CacheEntry]" = OrderedDict()
+
+async def fetch_feed(session: aiohttp.ClientSession, url: str, limit: int) -> List[JobItem]:
+    key = (url, limit)
+    cached = FEED_CACHE.get(key)
+    if cached is not None:
+        FEED_CACHE.move_to_end(key)
+        if cached.expires_at > time.time():
+            return cached.items
+
+    headers: Dict[str, str] = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+    status, resp_headers, data = await fetch_bytes(session, url, headers=headers)
+    if status == 304 and cached is not None:
+        # фид не менялся — ни тела, ни повторного разбора
+        cached.expires_at = time.time() + FEED_CACHE_TTL
+        return cached.items
+
+    items = parse_rss_titles_links(data, limit)
+    FEED_CACHE[key] = CacheEntry(
+        resp_headers.get("ETag"), resp_headers.get("Last-Modified"), items, time.time() + FEED_CACHE_TTL,
+    )
+    FEED_CACHE.move_to_end(key)
+    while len(FEED_CACHE) > FEED_CACHE_MAX:
+        FEED_CACHE.popitem(last=False)
+    return items
 
 # ---------- Build URLs ----------
 def build_dou_ua_feed_url(p: Prefs, *, search_terms: Optional[List[str]] = None, drop_category: bool = False) -> str:
     base = "https://jobs.dou.ua/vacancies/feeds/"
-    params: Dict[str, str] = {}
+    # набор ключей фиксирован — собираем query руками, без общего urlencode
+    parts: List[str] = []
 
     if not drop_category:
         cat = UA_CATEGORY_MAP.get(p.sphere or "ANY")
         if cat:
-            params["category"] = cat
+            parts.append(f"category={quote_plus(cat)}")
 
     if p.format_ == "REMOTE":
-        params["remote"] = ""
+        parts.append("remote=")
     if p.country == "INTL":
-        params["relocation"] = ""
+        parts.append("relocation=")
 
     terms: List[str] = []
     if p.sphere == "BACKEND":
@@ -184,14 +300,17 @@ def build_dou_ua_feed_url(p: Prefs, *, search_terms: Optional[List[str]] = None,
         terms.extend(search_terms)
 
     if terms:
-        params["search"] = " ".join(terms)
-        if any(x in " ".join(terms).lower() for x in ["part", "time", "contract", "back-end", "backend"]):
-            params["descr"] = "1"
+        search = " ".join(terms)
+        parts.append(f"search={quote_plus(search)}")
+        if any(x in search.lower() for x in ["part", "time", "contract", "back-end", "backend"]):
+            parts.append("descr=1")
 
-    return base + "?" + urlencode(params, doseq=True)
+    return base + "?" + "&".join(parts)
 
 # ---------- Scrapers ----------
-async def fetch_dou_ua(p: Prefs, limit: int = 12, debug_urls: Optional[List[str]] = None) -> List[str]:
+UA_FEED_CONCURRENCY = 5
+
+async def fetch_dou_ua(session: aiohttp.ClientSession, p: Prefs, limit: int = 12, debug_urls: Optional[List[str]] = None) -> List[JobItem]:
     tries = [
         build_dou_ua_feed_url(p, search_terms=None),
         build_dou_ua_feed_url(p, search_terms=["(part-time OR \"part time\" OR неповна зайнятість OR частичная занятость)"]),
@@ -199,108 +318,147 @@ async def fetch_dou_ua(p: Prefs, limit: int = 12, debug_urls: Optional[List[str]
         build_dou_ua_feed_url(p, search_terms=["(Part time OR Part-time OR Півставки)"]),
         build_dou_ua_feed_url(p, search_terms=None, drop_category=True),
     ]
-    headers = {"User-Agent": "Mozilla/5.0 (compatible; JobBot/1.0)"}
-    async with aiohttp.ClientSession(headers=headers) as session:
-        for url in tries:
-            if debug_urls is not None:
-                debug_urls.append(url)
+    sem = asyncio.Semaphore(UA_FEED_CONCURRENCY)
+
+    async def fetch_one(url: str):
+        async with sem:
+            return await fetch_feed(session, url, limit)
+
+    if debug_urls is not None:
+        debug_urls.extend(tries)
+    # все варианты качаем параллельно, но победителя выбираем в порядке приоритета tries
+    tasks = [asyncio.create_task(fetch_one(url)) for url in tries]
+    try:
+        for url, task in zip(tries, tasks):
             try:
-                feed = await fetch_feed(session, url)
+                entries = await task
             except Exception as e:
                 logging.warning("DOU.ua feed error for %s: %s", url, e)
                 continue
-            out: List[str] = []
-            for e in feed.entries[:120]:
-                title = getattr(e, "title", "")
-                link  = getattr(e, "link", "")
-                if not title or not link:
-                    continue
-                if contains_forbidden(title) or contains_forbidden(link):
-                    continue
-                out.append(f'<a href="{link}">{normalize_html(title)}</a>')
-                if len(out) >= limit:
-                    break
-            if out:
-                return out
-    return []
-
-async def fetch_dou_eu(p: Prefs, limit: int = 12, relax_if_empty: bool = True) -> List[str]:
+            if entries:
+                return entries
+        return []
+    finally:
+        for t in tasks:
+            t.cancel()
+        # забираем результаты, чтобы не было "Task exception was never retrieved"
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def fetch_dou_eu(session: aiohttp.ClientSession, p: Prefs, limit: int = 12, relax_if_empty: bool = True) -> List[JobItem]:
     url = "https://dou.eu/en/jobs"
-    headers = {"User-Agent": "Mozilla/5.0 (compatible; JobBot/1.0)"}
-    async with aiohttp.ClientSession(headers=headers) as session:
-        html_text = await fetch_text(session, url)
-    from bs4 import BeautifulSoup
-    soup = BeautifulSoup(html_text, "html.parser")
-    cards = soup.select("a[href*='/en/jobs/']")
-    results: List[str] = []
+    html_text = await fetch_text(session, url)
+    tree = LexborHTMLParser(html_text)
+    cards = tree.css("a[href*='/en/jobs/']")
+    results: List[JobItem] = []
 
     want_cat = (p.sphere and EU_CATEGORY_MAP.get(p.sphere)) or None
+    want_cat_lower = want_cat.lower() if want_cat else None
     want_remote   = (p.format_ == "REMOTE")
     want_office   = (p.format_ == "OFFICE")
     want_pt       = (p.format_ == "PARTTIME")
     want_contract = (p.format_ == "CONTRACT")
 
     def match_card_text(text: str, allow_relax: bool) -> bool:
-        if want_cat and want_cat.lower() not in text.lower(): return False
         if want_remote and ("Remote" not in text): return False
         if want_office and ("Remote" in text): return False
-        if want_pt and not any(s in text for s in ["Part-time", "part-time", "Part time"]):
+        if not (want_cat_lower or want_pt or want_contract): return True
+        text_lower = text.lower()
+        if want_cat_lower and want_cat_lower not in text_lower: return False
+        if want_pt and not any(tok in text_lower for tok in PT_TOKENS):
             if not allow_relax: return False
-        if want_contract and "Contract" not in text:
+        if want_contract and not any(tok in text_lower for tok in CONTRACT_TOKENS):
             if not allow_relax: return False
         return True
 
+    # (title, text, href) карточек, прошедших RU-фильтр: строгий проход собирает,
+    # ослабленный переиспользует без повторного обхода дерева
+    prepared: List[Tuple[str, str, str]] = []
     for a in cards:
-        title = a.get_text(strip=True)
-        card = a.find_parent()
-        if not card:
+        href = a.attributes.get("href")
+        if not href:
             continue
-        text = card.get_text(" ", strip=True)
-        if contains_forbidden(title) or contains_forbidden(text):
+        card = a.parent
+        if card is None:
             continue
-        if not match_card_text(text, allow_relax=False):
+        title = a.text(strip=True)
+        if contains_forbidden(title):
             continue
-        href = a.get("href")
-        if not href:
+        # текст карточки — самый дорогой шаг, считаем его только после дешёвых проверок
+        text = card.text(separator=" ", strip=True)
+        if contains_forbidden(text):
+            continue
+        prepared.append((title, text, href))
+        if not match_card_text(text, allow_relax=False):
             continue
-        results.append(f'<a href="{href}">{normalize_html(title)}</a>')
+        results.append((title, href))
         if len(results) >= limit:
             break
 
     if not results and relax_if_empty and (want_pt or want_contract):
-        for a in cards:
-            title = a.get_text(strip=True)
-            card = a.find_parent()
-            if not card:
-                continue
-            text = card.get_text(" ", strip=True)
-            if contains_forbidden(title) or contains_forbidden(text):
-                continue
+        # строгий проход ничего не нашёл, значит дошёл до конца и prepared полон
+        for title, text, href in prepared:
             if not match_card_text(text, allow_relax=True):
                 continue
-            href = a.get("href")
-            if not href:
-                continue
-            results.append(f'<a href="{href}">{normalize_html(title)}</a>')
+            results.append((title, href))
             if len(results) >= limit:
                 break
     return results
 
 # ---------- Search orchestrator ----------
-async def search_jobs(p: Prefs, debug_urls: Optional[List[str]] = None) -> List[str]:
-    if p.country in ("UA", "INTL", "ANY", None):
-        try:
-            items = await fetch_dou_ua(p, debug_urls=debug_urls)
-            if not items and p.format_ in ("PARTTIME", "CONTRACT"):
-                return await fetch_dou_eu(p, relax_if_empty=True)
-            if not items:
-                return await fetch_dou_eu(p, relax_if_empty=False)
+SEARCH_DEADLINE = 12  # секунд на весь поиск, сколько бы запросов ни было внутри
+
+async def _guarded(coro):
+    # ошибка одного сайта не должна отменять соседние задачи TaskGroup
+    try:
+        return await coro
+    except Exception as e:
+        return e
+
+async def search_jobs(session: aiohttp.ClientSession, p: Prefs, debug_urls: Optional[List[str]] = None) -> List[JobItem]:
+    if p.country not in ("UA", "INTL", "ANY", None):
+        async with asyncio.timeout(SEARCH_DEADLINE):
+            return await fetch_dou_eu(session, p, relax_if_empty=True)
+
+    async with asyncio.timeout(SEARCH_DEADLINE), asyncio.TaskGroup() as tg:
+        ua_task = tg.create_task(_guarded(fetch_dou_ua(session, p, debug_urls=debug_urls)))
+        eu_task: Optional[asyncio.Task] = None
+        if p.format_ in ("PARTTIME", "CONTRACT"):
+            # для частичной занятости/контракта EU чаще выигрывает — качаем его сразу, параллельно
+            eu_task = tg.create_task(_guarded(fetch_dou_eu(session, p, relax_if_empty=True)))
+
+        items = await ua_task
+        ua_failed = isinstance(items, Exception)
+        if ua_failed:
+            logging.warning("UA feed failed: %s", items)
+        elif items:
+            if eu_task is not None:
+                eu_task.cancel()
             return items
-        except Exception as e:
-            logging.warning("UA feed failed: %s", e)
-            return await fetch_dou_eu(p, relax_if_empty=True)
-    else:
-        return await fetch_dou_eu(p, relax_if_empty=True)
+
+        if eu_task is None:
+            eu_items = await _guarded(fetch_dou_eu(session, p, relax_if_empty=ua_failed))
+        else:
+            eu_items = await eu_task
+    # ошибку поднимаем уже вне TaskGroup, иначе она придёт завёрнутой в ExceptionGroup
+    if isinstance(eu_items, Exception):
+        raise eu_items
+    return eu_items
+
+# ---------- Views ----------
+def view_hash(message_id: int, text: str, markup: InlineKeyboardMarkup) -> str:
+    raw = f"{message_id}\n{text}\n{markup.model_dump_json()}"
+    return hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
+async def edit_view(c: CallbackQuery, state: FSMContext, text: str, markup: InlineKeyboardMarkup,
+                    *, data: Optional[Dict] = None, **kwargs) -> None:
+    # Telegram отвечает BadRequest на правку без изменений — такие правки просто пропускаем
+    view = view_hash(c.message.message_id, text, markup)
+    if data is None:
+        data = await state.get_data()
+    if data.get("last_view") == view:
+        return
+    await c.message.edit_text(text, reply_markup=markup, **kwargs)
+    await state.update_data(last_view=view)
 
 # ---------- Router ----------
 r = Router()
@@ -308,12 +466,12 @@ r = Router()
 @r.message(CommandStart())
 async def cmd_start(m: Message, state: FSMContext):
     await state.set_state(JobWizard.country)
-    await state.update_data(prefs=Prefs().__dict__, debug_urls=[])
+    await state.update_data(country=None, sphere=None, format_=None, debug_urls=[])
     await m.answer(
         "🦉 Привет! Я Duo-бот для поиска работы.\n"
         f"Автор: <a href=\"{OWNER_URL}\">{OWNER_NAME}</a>\n\n"
         "Выбери страну/площадку:",
-        reply_markup=kb_options(COUNTRIES, "country", add_back=False)
+        reply_markup=KB_COUNTRY
     )
 
 @r.message(Command("about"))
@@ -342,41 +500,27 @@ async def cmd_debug(m: Message, state: FSMContext):
 @r.callback_query(F.data.startswith("country:"))
 async def choose_country(c: CallbackQuery, state: FSMContext):
     code = c.data.split(":", 1)[1]
-    data = await state.get_data()
-    prefs = Prefs(**data.get("prefs", {}))
-    prefs.country = code
-    await state.update_data(prefs=prefs.__dict__)
+    data = await state.update_data(country=code)
     await state.set_state(JobWizard.sphere)
-    await c.message.edit_text(
-        "Отлично! Теперь выбери сферу:",
-        reply_markup=kb_options(SPHERES, "sphere", add_back=True)
-    )
+    await edit_view(c, state, "Отлично! Теперь выбери сферу:", KB_SPHERE, data=data)
     await c.answer()
 
 @r.callback_query(F.data.startswith("sphere:"))
 async def choose_sphere(c: CallbackQuery, state: FSMContext):
     code = c.data.split(":", 1)[1]
-    data = await state.get_data()
-    prefs = Prefs(**data.get("prefs", {}))
-    prefs.sphere = code
-    await state.update_data(prefs=prefs.__dict__)
+    data = await state.update_data(sphere=code)
     await state.set_state(JobWizard.format_)
-    await c.message.edit_text(
-        "И последний шаг — выбери формат работы:",
-        reply_markup=kb_options(FORMATS, "format", add_back=True)
-    )
+    await edit_view(c, state, "И последний шаг — выбери формат работы:", KB_FORMAT, data=data)
     await c.answer()
 
 @r.callback_query(F.data.startswith("format:"))
 async def choose_format(c: CallbackQuery, state: FSMContext):
     code = c.data.split(":", 1)[1]
-    data = await state.get_data()
-    prefs = Prefs(**data.get("prefs", {}))
-    prefs.format_ = code
-    await state.update_data(prefs=prefs.__dict__)
+    data = await state.update_data(format_=code)
+    prefs = prefs_from_data(data)
     await state.set_state(JobWizard.review)
     txt = "✅ Выбор сохранён!\n\n" + prefs_to_text(prefs) + "\n\nЧто делаем дальше?"
-    await c.message.edit_text(txt, reply_markup=kb_review())
+    await edit_view(c, state, txt, KB_REVIEW, data=data)
     await c.answer()
 
 @r.callback_query(F.data == "nav:back")
@@ -384,22 +528,13 @@ async def go_back(c: CallbackQuery, state: FSMContext):
     cur = await state.get_state()
     if cur == JobWizard.sphere:
         await state.set_state(JobWizard.country)
-        await c.message.edit_text(
-            "Выбери страну/площадку:",
-            reply_markup=kb_options(COUNTRIES, "country", add_back=False)
-        )
+        await edit_view(c, state, "Выбери страну/площадку:", KB_COUNTRY)
     elif cur == JobWizard.format_:
         await state.set_state(JobWizard.sphere)
-        await c.message.edit_text(
-            "Выбери сферу:",
-            reply_markup=kb_options(SPHERES, "sphere", add_back=True)
-        )
+        await edit_view(c, state, "Выбери сферу:", KB_SPHERE)
     elif cur == JobWizard.review:
         await state.set_state(JobWizard.format_)
-        await c.message.edit_text(
-            "Снова формат работы:",
-            reply_markup=kb_options(FORMATS, "format", add_back=True)
-        )
+        await edit_view(c, state, "Снова формат работы:", KB_FORMAT)
     await c.answer()
 
 @r.callback_query(F.data == "nav:reset")
@@ -411,30 +546,29 @@ async def do_reset(c: CallbackQuery, state: FSMContext):
 @r.callback_query(F.data == "nav:edit")
 async def edit_selection(c: CallbackQuery, state: FSMContext):
     await state.set_state(JobWizard.country)
-    await c.message.edit_text(
-        "Ок, поменяем. Выбери страну/площадку:",
-        reply_markup=kb_options(COUNTRIES, "country", add_back=False)
-    )
+    await edit_view(c, state, "Ок, поменяем. Выбери страну/площадку:", KB_COUNTRY)
     await c.answer()
 
 @r.callback_query(F.data == "do:search")
-async def do_search(c: CallbackQuery, state: FSMContext):
+async def do_search(c: CallbackQuery, state: FSMContext, http: aiohttp.ClientSession):
     data = await state.get_data()
-    prefs = Prefs(**data.get("prefs", {}))
+    prefs = prefs_from_data(data)
     debug_urls: List[str] = data.get("debug_urls", [])
     try:
-        results = await search_jobs(prefs, debug_urls=debug_urls)
+        results = await search_jobs(http, prefs, debug_urls=debug_urls)
+        body = render_jobs(results) if results else "Ничего не нашёл 🙈 Попробуй ослабить фильтры."
+    except TimeoutError:
+        body = "⏳ Сайты вакансий не ответили вовремя. Попробуй ещё раз чуть позже."
     except Exception as e:
-        results = [f"Не удалось получить вакансии: {e}"]
+        body = f"• Не удалось получить вакансии: {normalize_html(str(e))}"
     await state.update_data(debug_urls=debug_urls)
 
     header = "🔎 Нашёл вот что по твоим фильтрам:\n\n" + prefs_to_text(prefs) + "\n\n"
-    body = "\n".join(f"• {r}" for r in results) if results else "Ничего не нашёл 🙈 Попробуй ослабить фильтры."
     tail = (
         "\n\nДля диагностики напиши /debug — покажу URL запросов к RSS."
         f"\nАвтор бота: <a href=\"{OWNER_URL}\">{OWNER_NAME}</a>"
     )
-    await c.message.edit_text(header + body + tail, reply_markup=kb_review(), disable_web_page_preview=True)
+    await edit_view(c, state, header + body + tail, KB_REVIEW, data=data, disable_web_page_preview=True)
     await c.answer("Готово!")
 
 @r.callback_query(F.data == "do:save")
@@ -442,17 +576,35 @@ async def do_save(c: CallbackQuery, state: FSMContext):
     await c.answer("Сохранил пресет (демо).", show_alert=True)
 
 # ---------- App ----------
+def make_fsm_storage() -> BaseStorage:
+    if not REDIS_URL:
+        # один процесс: данные FSM живут в памяти как обычные объекты, без сериализации
+        return MemoryStorage()
+    from aiogram.fsm.storage.redis import RedisStorage
+    try:
+        import orjson
+    except ImportError:
+        # orjson опционален — без него aiogram использует stdlib json
+        return RedisStorage.from_url(REDIS_URL)
+    return RedisStorage.from_url(REDIS_URL, json_loads=orjson.loads, json_dumps=lambda obj: orjson.dumps(obj).decode())
+
 async def main():
     bot = Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher()
+    dp = Dispatcher(storage=make_fsm_storage())
     dp.include_router(r)
+    session = make_http_session()
+    # aiogram прокидывает workflow data в хендлеры по имени аргумента (`http`)
+    dp["http"] = session
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
-    except Exception:
-        pass
-    me = await bot.get_me()
-    logging.info("Бот запущен: @%s (id=%s). Жду /start…", me.username, me.id)
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        try:
+            await bot.delete_webhook(drop_pending_updates=True)
+        except Exception:
+            pass
+        me = await bot.get_me()
+        logging.info("Бот запущен: @%s (id=%s). Жду /start…", me.username, me.id)
+        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        await session.close()
 
 if __name__ == "__main__":
     asyncio.run(main())